@@ -1,34 +1,96 @@
-#!/usr/bin/env python
-from __future__ import print_function
+#!/usr/bin/env python3
 import time
 import sys
+import atexit
+import functools
 import getopt
+import io
 import os
+import re
+from collections import namedtuple
+from types import MappingProxyType
+
+# lookup tables for one keyboard / language pair, see DuckEncoder.buildTables()
+EncoderTables = namedtuple("EncoderTables", ["ascii_table", "keyname_table", "modifier_table",
+                                             "mod_ctrl_alt", "mod_ctrl_shift", "mod_gui_alt", "mod_alt_shift",
+                                             "keyboard", "language"])
+
+# alternative names for key instructions, translated to the name of the KEY_ entry
+_KEY_ALIAS = {"ESCAPE": "ESC",
+              "RETURN": "ENTER",
+              "DEL": "DELETE",
+              "BREAK": "PAUSE",
+              "CONTROL": "CTRL",
+              "DOWNARROW": "DOWN",
+              "UPARROW": "UP",
+              "LEFTARROW": "LEFT",
+              "RIGHTARROW": "RIGHT",
+              "MENU": "APP",
+              "WINDOWS": "GUI",
+              "PLAY": "MEDIA_PLAY_PAUSE",
+              "PAUSE": "MEDIA_PLAY_PAUSE",
+              "STOP": "MEDIA_STOP",
+              "MUTE": "MEDIA_MUTE",
+              "VOLUMEUP": "MEDIA_VOLUME_INC",
+              "VOLUMEDOWN": "MEDIA_VOLUME_DEC",
+              "SCROLLLOCK": "SCROLL_LOCK",
+              "NUMLOCK": "NUM_LOCK",
+              "CAPSLOCK": "CAPS_LOCK"}
+
+# bound once, used between HID reports for delay codes
+_sleep = time.sleep
+
+# directory of this script and of the keyboard / language property files
+_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__)) or "."
+_RES_DIR = os.path.join(_SCRIPT_DIR, "resources")
+_KEYBOARD_FILE = os.path.join(_RES_DIR, "keyboard.properties")
+
+# whitespace stripped from script lines and arguments, only ASCII whitespace, so that
+# characters like NBSP (ISO 8859-1 0xA0) at the ends of a STRING are kept and typed
+_WHITESPACE = " \t\n\r\f\v"
+
+# script lines which are skipped: blank lines and comments (// or REM)
+_SKIP_RE = re.compile(r"\s*(?:$|//|REM(?:\s|$))", re.ASCII)
 
 class DuckEncoder:
+        # fixed set of instance attributes, no per instance __dict__ (private names are mangled)
+        __slots__ = ("DEBUG", "keyboard", "language", "__key_dev_file", "__str_lang", "_hid", "_tables")
+
+        # property files don't change at runtime, so every file is only parsed once
+        # (the parsed properties are shared and thus returned read-only)
         @staticmethod
+        @functools.lru_cache(maxsize=32)
         def readResource(filename):
                 result_dict = {}
-                lines = []
                 with open(filename, "r") as f:
-                        lines = f.readlines()
-                for l in lines:
-                        # remove comment from line
-                        l = l.split("//")[0]
-                        # remove line breaks
-                        l = l.strip().replace("\r\n", "").replace("\n", "")
-
-                        # skip empty lines
-                        if len(l) == 0:
-                                continue
+                        for l in f:
+                                # remove comment and line breaks from line
+                                l = l.partition("//")[0].strip()
 
-                        key, val = l.split("=", 1)
-                        result_dict[key.strip()] = val.strip()
+                                # skip empty lines
+                                if not l:
+                                        continue
 
-                return result_dict
+                                i = l.find("=")
+                                if i < 0:
+                                        # no property assignment
+                                        continue
+                                key = l[:i].strip()
+                                val = l[i + 1:].strip()
+                                try:
+                                        # keycode / modifier values are stored as int, from hex or base 10
+                                        val = int(val, 16) if val.startswith(("0x", "0X")) else int(val)
+                                except ValueError:
+                                        # key entry lists of characters are stored as tuple of entry names,
+                                        # anything else is kept as string
+                                        if key.startswith(("ASCII_", "ISO_8859_1_")):
+                                                val = tuple(key_entry.strip() for key_entry in val.split(","))
+                                result_dict[key] = val
+
+                return MappingProxyType(result_dict)
 
         @staticmethod
-        def parseScriptLine(line, keyProp, langProp):
+        def parseScriptLine(line, tables):
                 """
                 parses a script line and returns the corresponding USB bytes or
                 an empty string if no match is found. It handles various commands
@@ -38,20 +100,17 @@ class DuckEncoder:
                     line (str): input line being processed, which allows the
                         function to interpret and encode different types of keyboard
                         input commands based on their specific format and structure.
-                    keyProp (dict): 16-bit USB property value that contains the
-                        keycode information for the current keyboard layout, which
-                        is used to map the encoded command to the corresponding
+                    tables (EncoderTables): lookup tables for the current keyboard
+                        and language layout, as returned by `DuckEncoder.buildTables()`,
+                        which are used to map the encoded command to the corresponding
                         USB byte values.
-                    langProp (str): 2-letter language code for the keyboard layout
-                        and is used to encode the input string as USB byte values
-                        based on the selected keyboard layout.
 
                 Returns:
                     : USB bytes.: a USB byte array representing a single keyboard
                     input, based on the script line provided.
                     
                     	1/ `result`: This is the actual encoded USB command that will
-                    be sent to the keyboard. It is a bytearray representing the
+                    be sent to the keyboard. It is a bytes object representing the
                     USB hexadecimal code for the key combination specified in the
                     input string.
                     	2/ `cmd`: This variable contains the command or key combination
@@ -62,14 +121,6 @@ class DuckEncoder:
                     provided after the key combination, if applicable. For example,
                     if the input was "MODIFIERKEY_LEFT_CTRL+ALT", then `args` would
                     contain the string "ALT".
-                    	4/ `keyProp`: This variable contains the property name of the
-                    keyboard key that corresponds to the key combination specified
-                    in the input string. For example, if the input was
-                    "MODIFIERKEY_LEFT_CTRL", then `keyProp` would be "MODIFIERKEY_LEFT_CTRL".
-                    	5/ `langProp`: This variable contains the language property
-                    name of the keyboard key that corresponds to the key combination
-                    specified in the input string. For example, if the input was
-                    "MODIFIERKEY_LEFT_CTRL", then `langProp` would be "MODIFIERKEY".
                     
                     	In summary, the `parseScriptLine` function takes a script
                     line as input and returns an encoded USB command that can be
@@ -79,160 +130,37 @@ class DuckEncoder:
                     and scenarios.
 
                 """
-                result = ""
-
                 # split line into command and arguments
                 cmd, _, args = line.partition(" ")
-                cmd = cmd.strip()
-                args = args.strip()
-
-                # DELAY (don't check if second argument is present and int type)
-                if cmd == "DELAY":
-                        delay = int(args)
-                        result = DuckEncoder.delay2USBBytes(delay)
-
-                # STRING
-                elif cmd == "STRING":
-                        if not args:
-                                return ""
-                        # for every char
-                        for c in args:
-                                keydata = DuckEncoder.ASCIIChar2USBBytes(c, keyProp, langProp)
-                                if len(keydata) > 0:
-                                        result += keydata
-
-                # STRING_DELAY
-                elif cmd == "STRING_DELAY":
-                        if not args:
-                                return ""
-
-                        # split away delay argument from remaining string
-                        delay, chars = args.split(" ", 1)
-
-                        # build delaystr
-                        delay = int(delay.strip())
-                        delaystr = DuckEncoder.delay2USBBytes(delay)
-
-                        # for every char
-                        for c in chars.strip():
-                                keydata = DuckEncoder.ASCIIChar2USBBytes(c, keyProp, langProp)
-                                if len(keydata) > 0:
-                                        result += keydata + delaystr
-
-                elif cmd in ("CONTROL", "CTRL"):
-                        # check if second argument after CTRL / Control
-                        if args:
-                                # given key with CTRL modifier
-                                result = (DuckEncoder.keyInstr2USBBytes(args, keyProp, langProp) +
-                                          DuckEncoder.prop2USBByte("MODIFIERKEY_CTRL", keyProp, langProp))
-                        else:
-                                # left CTRL without modifier
-                                result = DuckEncoder.prop2USBByte("KEY_LEFT_CTRL") + "\x00"
-
-                elif cmd == "ALT":
-                        # check if second argument after  ALT
-                        if args:
-                                # given key with CTRL modifier
-                                result = (DuckEncoder.keyInstr2USBBytes(args, keyProp, langProp) +
-                                          DuckEncoder.prop2USBByte("MODIFIERKEY_ALT", keyProp, langProp))
-                        else:
-                                # left ALT without modifier
-                                result = DuckEncoder.prop2USBByte("KEY_LEFT_ALT") + "\x00"
-
-                elif cmd == "SHIFT":
-                        # check if second argument after  ALT
-                        if args:
-                                # given key with CTRL modifier
-                                result = (DuckEncoder.keyInstr2USBBytes(args, keyProp, langProp) +
-                                          DuckEncoder.prop2USBByte("MODIFIERKEY_SHIFT", keyProp, langProp))
-                        else:
-                                # left SHIFT without modifier
-                                result = DuckEncoder.prop2USBByte("KEY_LEFT_SHIFT") + "\x00"
-
-                elif cmd == "CTRL-ALT":
-                        # check if second argument after CTRL+ ALT
-                        if args:
-                                # key
-                                result += DuckEncoder.keyInstr2USBBytes(args, keyProp, langProp)
-                                # modifier for CTRL and ALT or'ed  together
-                                result += chr(ord(DuckEncoder.prop2USBByte("MODIFIERKEY_CTRL", keyProp, langProp)) |
-                                              ord(DuckEncoder.prop2USBByte("MODIFIERKEY_ALT", keyProp, langProp)))
-                        else:
-                                return ""
-
-                elif cmd == "CTRL-SHIFT":
-                        # check if second argument after CTRL+ SHIFT
-                        if args:
-                                # key
-                                result += DuckEncoder.keyInstr2USBBytes(args, keyProp, langProp)
-                                # modifier for CTRL and SHIFT or'ed  together
-                                result += chr(ord(DuckEncoder.prop2USBByte("MODIFIERKEY_CTRL", keyProp, langProp)) |
-                                              ord(DuckEncoder.prop2USBByte("MODIFIERKEY_SHIFT", keyProp, langProp)))
-                        else:
-                                return ""
-
-                elif cmd == "COMMAND-OPTION":
-                        # check if second argument after CTRL+ SHIFT
-                        if args:
-                                # key
-                                result += DuckEncoder.keyInstr2USBBytes(args, keyProp, langProp)
-                                # modifier for CTRL and SHIFT or'ed  together
-                                result += chr(ord(DuckEncoder.prop2USBByte("MODIFIERKEY_LEFT_GUI", keyProp, langProp)) |
-                                              ord(DuckEncoder.prop2USBByte("MODIFIERKEY_ALT", keyProp, langProp)))
-                        else:
-                                return ""
-
-                elif cmd == "ALT-SHIFT":
-                        # check if second argument after CTRL+ SHIFT
-                        if args:
-                                # key
-                                result += DuckEncoder.keyInstr2USBBytes(args, keyProp, langProp)
-                                # modifier for CTRL and SHIFT or'ed  together
-                                result += chr(ord(DuckEncoder.prop2USBByte("MODIFIERKEY_LEFT_ALT", keyProp, langProp)) |
-                                              ord(DuckEncoder.prop2USBByte("MODIFIERKEY_SHIFT", keyProp, langProp)))
-                        else:
-                                # key
-                                result += DuckEncoder.prop2USBByte("KEY_LEFT_ALT", keyProp, langProp)
-                                # modifier for CTRL and SHIFT or'ed  together
-                                result += chr(ord(DuckEncoder.prop2USBByte("MODIFIERKEY_LEFT_ALT", keyProp, langProp)) |
-                                              ord(DuckEncoder.prop2USBByte("MODIFIERKEY_SHIFT", keyProp, langProp)))
-
-                elif cmd == "ALT-TAB":
-                        # check if second argument after CTRL+ SHIFT
-                        if args:
-                                return ""
-                        else:
-                                # key
-                                result += DuckEncoder.prop2USBByte("KEY_TAB", keyProp, langProp)
-                                # modifier for CTRL and SHIFT or'ed  together
-                                result += DuckEncoder.prop2USBByte("MODIFIERKEY_LEFT_ALT", keyProp, langProp)
-
-                elif cmd in ("GUI", "WINDOWS"):
-                        # check if second argument after  ALT
-                        if args:
-                                # given key with CTRL modifier
-                                result = (DuckEncoder.keyInstr2USBBytes(args, keyProp, langProp) +
-                                          DuckEncoder.prop2USBByte("MODIFIERKEY_LEFT_GUI", keyProp, langProp))
-                        else:
-                                # left SHIFT without modifier
-                                result = (DuckEncoder.prop2USBByte("KEY_LEFT_GUI", keyProp, langProp) +
-                                          DuckEncoder.prop2USBByte("MODIFIERKEY_LEFT_GUI", keyProp, langProp))
-
-                elif cmd == "COMMAND":
-                        # check if second argument after  ALT
-                        if args:
-                                # given key with CTRL modifier
-                                result = (DuckEncoder.keyInstr2USBBytes(args, keyProp, langProp) +
-                                          DuckEncoder.prop2USBByte("MODIFIERKEY_LEFT_GUI", keyProp, langProp))
-                        else:
-                                # left SHIFT without modifier
-                                result = DuckEncoder.prop2USBByte("KEY_COMMAND", keyProp, langProp) + "\x00"
+                cmd = cmd.strip(_WHITESPACE)
+                args = args.strip(_WHITESPACE)
 
-                else:
+                handler = _CMD_DISPATCH.get(cmd)
+                if handler is None:
                         # Everything else is handled as direct key input (worst case would be the first letter of a line interpreted as single key)
-                        result = DuckEncoder.keyInstr2USBBytes(cmd, keyProp, langProp) + "\x00"
+                        return DuckEncoder.keyInstr2USBBytes(cmd, tables) + b"\x00"
+
+                return handler(args, tables)
+
+        @staticmethod
+        def makeLineParser(tables):
+                """
+                returns a line parser with the lookup tables of one keyboard /
+                language pair bound to `DuckEncoder.parseScriptLine()`. Results
+                are cached, so lines occuring more than once in a script (f.e.
+                "DELAY 100" or "ENTER") are encoded only once.
 
-                return result
+                Args:
+                    tables (EncoderTables): lookup tables as returned by
+                        `DuckEncoder.buildTables()`.
+
+                Returns:
+                    function: a function taking a stripped script line and
+                    returning its encoded USB bytes.
+
+                """
+                parseLine = functools.partial(DuckEncoder.parseScriptLine, tables=tables)
+                return functools.lru_cache(maxsize=4096)(parseLine)
 
         @staticmethod
         def prop2USBByte(prop, keyProp, langProp):
@@ -275,10 +203,11 @@ class DuckEncoder:
                         the `keyProp`.
 
                 Returns:
-                    int: a binary string character representing the converted
-                    keycode or modifier value.
+                    bytes: a single byte representing the converted keycode or
+                    modifier value.
 
                 """
+                keyval = None
                 if prop in keyProp:
                         keyval = keyProp[prop]
                 elif prop in langProp:
@@ -287,16 +216,10 @@ class DuckEncoder:
                 if keyval is None:
                         print("Error: No keycode entry for {0}".format(prop))
                         print("Warning this could corrupt generated output file")
-                        return ""
-                if keyval[0:2].upper() == "0X":
-                        # conver to int from hex
-                        keyval = int(keyval, 16)
-                else:
-                        # convert to int
-                        keyval = int(keyval)
+                        return b""
 
-                # convert byte key / modifier value to binary string character
-                return chr(keyval)
+                # convert byte key / modifier value to a single byte
+                return bytes((keyval,))
 
         # converts a delay given as interger to payload bytes
         @staticmethod
@@ -311,22 +234,17 @@ class DuckEncoder:
                     delay (int): 8-bit binary data to be converted into USB bytes.
 
                 Returns:
-                    str: a binary string consisting of a series of alternating 0s
-                    and Fs, followed by a single character representing the remaining
+                    bytes: a byte string consisting of a series of alternating 0s
+                    and Fs, followed by a single byte representing the remaining
                     portion of the delay value.
 
                 """
-                result = ""
-                count = delay / 255
-                remain = delay % 255
-                for i in range(count):
-                        result += "\x00\xFF"
-                result += "\x00" + chr(remain)
-                return result
+                count, remain = divmod(delay, 255)
+                return b"\x00\xFF" * count + b"\x00" + bytes((remain,))
 
         # returns USB key byte and modifier byte for the given partial single key instruction
         @staticmethod
-        def keyInstr2USBBytes(keyinstr, keyProp, langProp):
+        def keyInstr2USBBytes(keyinstr, tables):
                 ####
                 # Language fix
                 # - a key instruction which is only 1 char in length, is represented as single ASCII char
@@ -344,18 +262,13 @@ class DuckEncoder:
                     keyinstr (str): 1-character key instruction to be translated
                         into a USB byte value, and its length is verified to ensure
                         it contains only a single ASCII character.
-                    keyProp (dict): 16-bit code of the keyboard layout's property
-                        dictionary for the currently active layout, which contains
-                        the translation between the user's input and the corresponding
-                        keycode value.
-                    langProp (str): 2D array of keyboard shortcuts for different
-                        languages, which is used to map the original key instruction
-                        to the appropriate modifier and key combination for each
-                        language layout.
+                    tables (EncoderTables): lookup tables for the currently active
+                        keyboard and language layout, which contain the translation
+                        between the user's input and the corresponding keycode value.
 
                 Returns:
-                    ASCII character.: a binary string character representing a USB
-                    keyboard key or modifier value.
+                    bytes: a single byte representing a USB keyboard key or
+                    modifier value.
                     
                     		- `keyval`: A variable that holds the translated USB byte
                     value for the given key instruction, or `None` if no matching
@@ -363,12 +276,9 @@ class DuckEncoder:
                     		- `key_entry`: A string representing the raw key instruction
                     entered by the user, which is used as a starting point for the
                     translation process.
-                    		- `keyProp`: A dictionary that contains mappings between raw
-                    key instructions and their corresponding USB byte values for
-                    the current keyboard layout.
-                    		- `langProp`: A dictionary that contains mappings between
-                    raw key instructions and their corresponding USB byte values
-                    for different languages or layouts.
+                    		- `tables.keyname_table`: A dictionary that contains mappings
+                    between key names and their corresponding USB byte values for
+                    the current keyboard and language layout.
                     
                     	The function takes into account various aspects of the input
                     key instruction, such as:
@@ -380,74 +290,40 @@ class DuckEncoder:
                     		- Modifiers: The function takes into account the presence
                     of modifier keys (such as Control, Alt, or Shift) and translates
                     them accordingly based on their associated values in the
-                    `keyProp` dictionary.
+                    keyboard properties.
                     		- Language: If the input key instruction is not present in
                     either the keyboard or language properties, it is translated
-                    to the closest matching entry based on the language properties
-                    using the `langProp` dictionary.
+                    to the closest matching entry based on the language properties.
 
                 """
                 keyval = None
                 key_entry = ""
                 if len(keyinstr) == 1:
-                        keyval = DuckEncoder.ASCIIChar2USBBytes(keyinstr, keyProp, langProp)[0]
+                        keyval = DuckEncoder.tableChar2USBBytes(keyinstr, tables)[0:1]
                         return keyval
                 else:
-                        key_entry = "KEY_" + keyinstr.strip()
+                        key_entry = "KEY_" + keyinstr.strip(_WHITESPACE)
 
-                # check keyboard property (first attempt)
-                if key_entry in keyProp:
-                        keyval = keyProp[key_entry]
-                elif key_entry in langProp:
-                        keyval = langProp[key_entry]
+                # check keyboard and language property (first attempt)
+                keyval = tables.keyname_table.get(key_entry)
 
                 # try to translate into valid KEY, if no hit on first attempt
                 if keyval is None:
-                        keyinstr = keyinstr.strip().upper()
-                        keyinstr = {"ESCAPE": "ESC",
-                                    "RETURN": "ENTER",
-                                    "DEL": "DELETE",
-                                    "BREAK": "PAUSE",
-                                    "CONTROL": "CTRL",
-                                    "DOWNARROW": "DOWN",
-                                    "UPARROW": "UP",
-                                    "LEFTARROW": "LEFT",
-                                    "RIGHTARROW": "RIGHT",
-                                    "MENU": "APP",
-                                    "WINDOWS": "GUI",
-                                    "PLAY": "MEDIA_PLAY_PAUSE",
-                                    "PAUSE": "MEDIA_PLAY_PAUSE",
-                                    "STOP": "MEDIA_STOP",
-                                    "MUTE": "MEDIA_MUTE",
-                                    "VOLUMEUP": "MEDIA_VOLUME_INC",
-                                    "VOLUMEDOWN": "MEDIA_VOLUME_DEC",
-                                    "SCROLLLOCK": "SCROLL_LOCK",
-                                    "NUMLOCK": "NUM_LOCK",
-                                    "CAPSLOCK": "CAPS_LOCK"}.get(keyinstr)
+                        keyinstr = keyinstr.strip(_WHITESPACE).upper()
+                        keyinstr = _KEY_ALIAS.get(keyinstr, keyinstr)
 
                         # second attempt
-                        if keyinstr:
-                                key_entry = "KEY_" + keyinstr.strip()
-        
-                                if key_entry in keyProp:
-                                        keyval = keyProp[key_entry]
-                                elif key_entry in langProp:
-                                        keyval = langProp[key_entry]
+                        key_entry = "KEY_" + keyinstr
+                        keyval = tables.keyname_table.get(key_entry)
 
                 if keyval is None:
                         # avoid prints to STDOUT, which could be carried over raw data
                         sys.stderr.write("Error: No keycode entry for " + key_entry + "\n")
                         sys.stderr.write("Warning this could corrupt generated output file\n")
-                        return ""
-                if keyval[0:2].upper() == "0X":
-                        # conver to int from hex
-                        keyval = int(keyval, 16)
-                else:
-                        # convert to int
-                        keyval = int(keyval)
+                        return b""
 
-                # convert byte key / modifier value to binary string character
-                return chr(keyval)
+                # convert byte key / modifier value to a single byte
+                return bytes((keyval,))
 
         # returns USB key byte and modifier byte for the given ASCII key as binary String
         # Layout translation is done by the value given by langProp
@@ -475,11 +351,11 @@ class DuckEncoder:
                         keys.
 
                 Returns:
-                    str: a binary string representing a USB byte value based on
-                    an ASCII character value and language property file entries.
+                    bytes: USB key and modifier bytes based on an ASCII character
+                    value and language property file entries.
 
                 """
-                result = ""
+                result = bytearray()
                 # convert ordinal char value to hex string
                 val = ord(char)
                 hexval = str(hex(val))[2:].upper()
@@ -497,10 +373,9 @@ class DuckEncoder:
                 if name not in langProp:
                         print(char + " interpreted as " + name + ", but not found in chosen language property file. Skipping character!")
                 else:
-                        # if name, parse values (names of keyboard property entries) in language property file
-                        for key_entry in langProp[name].split(","):
+                        # if name, resolve values (names of keyboard property entries) in language property file
+                        for key_entry in langProp[name]:
                                 keyval = None
-                                key_entry = key_entry.strip()
                                 # check keyboard property
                                 if key_entry in keyProp:
                                         keyval = keyProp[key_entry]
@@ -509,19 +384,118 @@ class DuckEncoder:
                                 if keyval is None:
                                         print("Error: No keycode entry for " + key_entry)
                                         print("Warning this could corrupt generated output file")
-                                        return ""
-                                # convert to int from hex or base 10
-                                keyval = int(keyval, 16) if keyval[0:2].upper() == "0X" else int(keyval)
+                                        return b""
 
-                                # convert byte key / modifier value to binary string character
-                                result += chr(keyval)
+                                # append byte key / modifier value
+                                result.append(keyval)
                         # check if modifier has been added
                         if len(result) == 1:
-                                result += "\x00"
-                return result
+                                result.append(0)
+                return bytes(result)
+
+        @staticmethod
+        def buildTables(keyProp, langProp):
+                """
+                precomputes the lookup tables used to encode scripts for a given
+                keyboard and language layout, so that per character and per key
+                instruction only a single index or dict lookup is needed, instead
+                of resolving and parsing property entries again.
+
+                Args:
+                    keyProp (dict): keyboard property entries, as read from
+                        keyboard.properties.
+                    langProp (dict): language property entries, as read from the
+                        chosen language property file.
+
+                Returns:
+                    EncoderTables: `ascii_table` holds the USB bytes for every
+                    character value 0..255 (None if the language has no usable
+                    entry), `keyname_table` maps KEY_ names to their keycode and
+                    `modifier_table` maps MODIFIERKEY_ names to their modifier value.
+                    The `mod_` fields hold the or'ed modifier values used by the
+                    CTRL-ALT, CTRL-SHIFT, COMMAND-OPTION and ALT-SHIFT commands.
+                    `keyboard` and `language` hold the given property dicts.
+
+                """
+                # merged view of both property dicts, keyboard properties take precedence
+                # over language properties, so every entry is resolved with a single lookup
+                props = dict(langProp)
+                props.update(keyProp)
+
+                # key and modifier names
+                keyname_table = {}
+                modifier_table = {}
+                for name, keyval in props.items():
+                        if name.startswith("KEY_"):
+                                keyname_table[name] = keyval
+                        elif name.startswith("MODIFIERKEY_"):
+                                modifier_table[name] = keyval
+
+                # characters, only resolvable entries are added, anything else is left
+                # to ASCIIChar2USBBytes, which reports the missing entry
+                ascii_table = [None] * 256
+                for val in range(256):
+                        name = ("ASCII_%02X" if val < 0x80 else "ISO_8859_1_%02X") % val
+                        if name not in langProp:
+                                continue
+                        if all(key_entry in props for key_entry in langProp[name]):
+                                ascii_table[val] = DuckEncoder.ASCIIChar2USBBytes(chr(val), props, langProp)
+
+                # modifier combinations or'ed together
+                mod_ctrl_alt = modifier_table["MODIFIERKEY_CTRL"] | modifier_table["MODIFIERKEY_ALT"]
+                mod_ctrl_shift = modifier_table["MODIFIERKEY_CTRL"] | modifier_table["MODIFIERKEY_SHIFT"]
+                mod_gui_alt = modifier_table["MODIFIERKEY_LEFT_GUI"] | modifier_table["MODIFIERKEY_ALT"]
+                mod_alt_shift = modifier_table["MODIFIERKEY_LEFT_ALT"] | modifier_table["MODIFIERKEY_SHIFT"]
+
+                # the tables are shared between all users of a language (see langTables()),
+                # so they are returned read-only
+                return EncoderTables(tuple(ascii_table), MappingProxyType(keyname_table), MappingProxyType(modifier_table),
+                                     mod_ctrl_alt, mod_ctrl_shift, mod_gui_alt, mod_alt_shift,
+                                     keyProp, langProp)
+
+        # the tables of a language only depend on the (unchanging) property files, so they
+        # are built once per language and shared (raises IOError for a missing language file)
+        @staticmethod
+        @functools.lru_cache(maxsize=32)
+        def langTables(lang):
+                keyboard = DuckEncoder.readResource(_KEYBOARD_FILE)
+                language = DuckEncoder.readResource(os.path.join(_RES_DIR, "{0}.properties".format(lang)))
+                return DuckEncoder.buildTables(keyboard, language)
+
+        # returns USB key byte and modifier byte for the given char, using precomputed tables
+        @staticmethod
+        def tableChar2USBBytes(char, tables):
+                val = ord(char)
+                keydata = tables.ascii_table[val] if val < 256 else None
+                if keydata is None:
+                        # no table entry, fall back to property lookup (reports missing entries)
+                        keydata = DuckEncoder.ASCIIChar2USBBytes(char, tables.keyboard, tables.language)
+                return keydata
+
+        # returns USB key bytes and modifier bytes for all chars of the given string, using precomputed tables
+        @staticmethod
+        def tableString2USBBytes(string, tables):
+                ascii_table = tables.ascii_table
+                try:
+                        # fast path, if every char has a table entry the whole string is
+                        # encoded by map() / join() without running bytecode per char
+                        return b"".join(map(ascii_table.__getitem__, string.encode("latin-1")))
+                except (UnicodeEncodeError, TypeError):
+                        # at least one char without table entry (beyond 0xFF or None)
+                        pass
+
+                result = bytearray()
+                # for every char
+                for c in string:
+                        val = ord(c)
+                        keydata = ascii_table[val] if val < 256 else None
+                        if keydata is None:
+                                keydata = DuckEncoder.tableChar2USBBytes(c, tables)
+                        result.extend(keydata)
+                return bytes(result)
 
         @staticmethod
-        def parseScript(source, keyProp, langProp):
+        def parseScript(source, tables):
                 """
                 splits a script into individual lines, skips blank lines and
                 comments, and repeats an instruction with a specified number. It
@@ -529,51 +503,60 @@ class DuckEncoder:
                 `DuckEncoder.parseScriptLine()` function.
 
                 Args:
-                    source (str): 1000+ lines of script written by the customer
-                        that the code is intended to parse and return the resulting
-                        encoded representation of the script.
-                    keyProp (str): property key used for encoding and decoding.
-                    langProp (str): language of the script to be parsed, and is
-                        used to modify the behavior of the `DuckEncoder.parseScriptLine()`
-                        function call for each line of the script.
+                    source (str, bytes or iterable of str): 1000+ lines of script written
+                        by the customer that the code is intended to parse and return
+                        the resulting encoded representation of the script. Given an
+                        iterable (f.e. an open file), lines are consumed one by one.
+                        Bytes (f.e. read from a file opened in binary mode) are
+                        decoded as ISO 8859-1 once.
+                    tables (EncoderTables): lookup tables for the keyboard and
+                        language of the script to be parsed, as returned by
+                        `DuckEncoder.buildTables()`, which are bound once into the
+                        line parser from `DuckEncoder.makeLineParser()`.
 
                 Returns:
-                    str: a concatenation of parsed script lines from the input
+                    bytes: a concatenation of parsed script lines from the input
                     source code.
 
                 """
-                result = ""
-                lines = source.splitlines(True)
-
-                lastLine = None
-                for l in lines:
-                        # remove leading whtespace and any line breaks
-                        l = l.strip().replace("\r\n", "").replace("\n", "")
-
+                parts = []
+                if isinstance(source, (bytes, bytearray)):
+                        # decode once, ISO 8859-1 maps every byte to the character with the same code
+                        source = source.decode("latin-1")
+                if isinstance(source, str):
+                        # iterate lines without splitting the whole script into a list
+                        source = io.StringIO(source, newline=None)
+
+                # local bindings for the per line calls
+                _parse = DuckEncoder.makeLineParser(tables)
+                _skip = _SKIP_RE.match
+                _append = parts.append
+
+                lastBytes = None
+                for l in source:
                         # skip blank lines and comments
-                        if len(l) == 0 or l.startswith("//") or l.startswith("REM "):
+                        if _skip(l):
                                 continue
 
-                        # check for repeat instruction
-                        if l[0:7] == "REPEAT ":
-                                # check for second arg and presence of las instruction
-                                instr = l.split(" ", 1)
-                                if len(instr) == 1 or lastLine is None:
-                                        # second arg missing
-                                        continue
-                                else:
-                                        for i in range(int(instr[1].strip())):
-                                                result += DuckEncoder.parseScriptLine(lastLine, keyProp, langProp)
-                        else:
-                                result += DuckEncoder.parseScriptLine(l, keyProp, langProp)
+                        # remove leading whtespace and line break
+                        l = l.strip(_WHITESPACE)
 
-                        lastLine = l
+                        # check for repeat instruction (the stripped line always has a count after the space)
+                        if l.startswith("REPEAT "):
+                                # skip if there is no last instruction
+                                if lastBytes is not None:
+                                        # the encoded instruction doesn't change, so repeat its bytes
+                                        _append(lastBytes * int(l.partition(" ")[2]))
+                        else:
+                                # repeated lines are served from the cache of the line parser
+                                lastBytes = _parse(l)
+                                _append(lastBytes)
 
-                return result
+                return b"".join(parts)
 
         @staticmethod
         def pwd():
-                return os.path.dirname(__file__) or "."
+                return _SCRIPT_DIR
 
         @staticmethod
         def generatePayload(source, lang):
@@ -583,20 +566,17 @@ class DuckEncoder:
                 files to generate a payload based on the provided language.
 
                 Args:
-                    source (str): code that needs to be formatted and processed
-                        by the `generatePayload()` function.
+                    source (str, bytes or iterable of str): DuckyScript code that
+                        is handed to `DuckEncoder.parseScript()`.
                     lang (str): language code for which the payload will be generated.
 
                 Returns:
-                    str: a parse tree representing the source code, constructed
-                    from the language file and keyboard script.
+                    bytes: the encoded payload of the script, using the lookup
+                    tables of the keyboard and language property files.
 
                 """
-                script_dir = DuckEncoder.pwd()
-                keyboard = DuckEncoder.readResource(script_dir + "/resources/keyboard.properties")
-                language = DuckEncoder.readResource(script_dir + "/resources/" + lang + ".properties")
-
-                payload = DuckEncoder.parseScript(source, keyboard, language)
+                tables = DuckEncoder.langTables(lang)
+                payload = DuckEncoder.parseScript(source, tables)
                 return payload
 
         def out2hid(self, data):
@@ -607,26 +587,44 @@ class DuckEncoder:
                 if necessary.
 
                 Args:
-                    data (str): 8-bit byte sequence to be converted into HID inputs.
+                    data (bytes): 8-bit byte sequence to be converted into HID inputs.
 
                 """
-                import time
-                with open("/dev/hidg0", "wb") as f:
-                        for i in range(0, len(data), 2):
-                                out = ""
-                                key = ord(data[i:i + 1])
-                                if len(data[i + 1:i + 2]) == 0:  # no modifier byte
-                                        continue
-                                mod = ord(data[i + 1:i + 2])
-                                if (key == 0):
-                                        # delay code
-                                        d = float(mod) / 1000.0
-                                        time.sleep(d)
-                                out = chr(mod) + '\x00' + chr(key) + '\x00\x00\x00\x00\x00' + '\x00\x00\x00\x00\x00\x00\x00\x00'
-                                f.write(out)
-                                f.flush()
-                                # no delay between keypresses (hanfled by HID gadget)
-                                # time.sleep(0.01)
+                if isinstance(data, str):
+                        data = data.encode("latin-1")
+                keys = data[0::2]
+                mods = data[1::2]
+                # a trailing key byte without modifier byte is skipped
+                count = len(mods)
+                f = self._hid_file()
+                # the payload is split into segments at delay codes (key byte 0), the
+                # reports of a segment are written at once, before sleeping for the delay
+                start = 0
+                search = 0
+                while True:
+                        end = keys.find(b"\x00", search, count)
+                        if end < 0:
+                                end = count
+                        # no delay between keypresses (hanfled by HID gadget)
+                        # time.sleep(0.01)
+                        f.write(DuckEncoder.USBBytes2HIDReports(keys[start:end], mods[start:end]))
+                        if end == count:
+                                break
+                        # delay code, its report starts the next segment
+                        f.flush()
+                        d = float(mods[end]) / 1000.0
+                        _sleep(d)
+                        start = end
+                        search = end + 1
+                f.flush()
+
+        # returns 8 byte keyboard reports (modifier, reserved, 6 keycodes) for the given key and modifier bytes
+        @staticmethod
+        def USBBytes2HIDReports(keys, mods):
+                reports = bytearray(8 * len(keys))
+                reports[0::8] = mods
+                reports[2::8] = keys
+                return reports
 
         def outhidString(self, str):
                 """
@@ -635,18 +633,16 @@ class DuckEncoder:
 
                 Args:
                     str (str): 16-bit Unicode string that is converted into a USB
-                        byte payload using DuckEncoder.ASCIIChar2USBBytes and then
-                        transmitted to the host.
+                        byte payload using the lookup tables of the current language
+                        and then transmitted to the host.
 
                 """
-                payload = ""
-                for c in str:
-                        payload += DuckEncoder.ASCIIChar2USBBytes(c, self.keyboard, self.language)
+                payload = DuckEncoder.tableString2USBBytes(str, self._tables)
                 self.out2hid(payload)
 
         def outhidStringDirect(self, str):
                 """
-                writes a string to USB HID device "/dev/hidg0" using DuckEncoder
+                writes a string to the USB HID device (see `setKeyDevFile`) using DuckEncoder
                 ASCII character encoding. It takes a string as input and produces
                 output with modifier bytes added to each key press.
 
@@ -655,22 +651,27 @@ class DuckEncoder:
                         the USB device.
 
                 """
-                with open("/dev/hidg0", "wb") as f:
-                        for c in str:
-                                data = DuckEncoder.ASCIIChar2USBBytes(c, self.keyboard, self.language)
-                                for i in range(0, len(data), 2):
-                                        out = ""
-                                        key = ord(data[i:i + 1])
-                                        if len(data[i + 1:i + 2]) == 0:  # no modifier byte
-                                                continue
-                                        mod = ord(data[i + 1:i + 2])
-                                        if (key == 0):
-                                                # delay code
-                                                d = float(mod) / 1000.0
-                                                time.sleep(d)
-                                        out = chr(mod) + '\x00' + chr(key) + '\x00\x00\x00\x00\x00' + '\x00\x00\x00\x00\x00\x00\x00\x00'
-                                        f.write(out)
-                                f.flush()
+                f = self._hid_file()
+                # reports are collected and only written before a delay and at the end
+                buf = bytearray()
+                tables = self._tables
+                for c in str:
+                        data = DuckEncoder.tableChar2USBBytes(c, tables)
+                        # a trailing key byte without modifier byte is skipped by the range stop
+                        for i in range(0, len(data) - 1, 2):
+                                key = data[i]
+                                mod = data[i + 1]
+                                if (key == 0):
+                                        # delay code, send pending reports before sleeping
+                                        f.write(buf)
+                                        f.flush()
+                                        buf.clear()
+                                        d = float(mod) / 1000.0
+                                        _sleep(d)
+                                # 8 byte keyboard report: modifier, reserved, 6 keycodes
+                                buf.extend((mod, 0, key, 0, 0, 0, 0, 0))
+                f.write(buf)
+                f.flush()
 
         def outhidDuckyScript(self, source):
                 """
@@ -683,7 +684,7 @@ class DuckEncoder:
                         the DuckEncoder for processing.
 
                 """
-                payload = DuckEncoder.parseScript(source, self.keyboard, self.language)
+                payload = DuckEncoder.parseScript(source, self._tables)
                 self.out2hid(payload)
                 # return payload
 
@@ -706,12 +707,14 @@ class DuckEncoder:
                 res = ""
                 if self.__str_lang != str_lang:
                         try:
-                                self.language = DuckEncoder.readResource(DuckEncoder.pwd() + "/resources/" + str_lang + ".properties")
+                                self._tables = DuckEncoder.langTables(str_lang)
                         except IOError:
                                 res = "No language file for '{0}', resetting to 'us'".format(str_lang)
                                 self.print_debug(res)
-                                self.language = DuckEncoder.readResource(DuckEncoder.pwd() + "/resources/us.properties")
+                                self._tables = DuckEncoder.langTables("us")
+                                self.language = self._tables.language
                                 return res
+                        self.language = self._tables.language
                         self.__str_lang = str_lang
                         res = "language set to '{0}'".format(str_lang)
                         self.print_debug(res)
@@ -721,8 +724,32 @@ class DuckEncoder:
                 return self.__str_lang
 
         def setKeyDevFile(self, key_dev_file):
+                # an already opened device is closed, the new one is opened on next output
+                self.closeHID()
                 self.__key_dev_file = key_dev_file
 
+        def _hid_file(self):
+                # the HID device is opened on first output and kept open for all further writes,
+                # the buffered writer retries partial writes on flush (the gadget may accept less
+                # than a whole segment of reports per write call)
+                if self._hid is None:
+                        self._hid = open(self.__key_dev_file, "wb")
+                        atexit.register(self.closeHID)
+                return self._hid
+
+        def closeHID(self):
+                """
+                closes the USB HID device if it has been opened by one of the
+                `outhid...` methods. It is called automatically at interpreter
+                exit and when the device file is changed by `setKeyDevFile`.
+
+                """
+                if self._hid is not None:
+                        atexit.unregister(self.closeHID)
+                        hid = self._hid
+                        self._hid = None
+                        hid.close()
+
         def print_debug(self, str):
                 """
                 has a single argument `str`, which is a string that will be printed
@@ -749,12 +776,123 @@ class DuckEncoder:
 
                 """
                 self.DEBUG = False
-                self.keyboard = DuckEncoder.readResource(DuckEncoder.pwd() + "/resources/keyboard.properties")
+                self.keyboard = DuckEncoder.readResource(_KEYBOARD_FILE)
                 self.__key_dev_file = key_dev_file
+                # device file handle, opened lazily by _hid_file()
+                self._hid = None
                 self.__str_lang = ""
                 self.setLanguage(lang)
 
 
+####
+# DuckyScript command handlers
+# - every handler is called with the arguments following the command and the
+#   EncoderTables of the current layout and returns the encoded USB bytes
+# - commands not in _CMD_DISPATCH are handled as direct key input by parseScriptLine
+#####
+def _handle_delay(args, tables):
+        # DELAY (don't check if second argument is present and int type)
+        return DuckEncoder.delay2USBBytes(int(args))
+
+
+def _handle_string_delay(args, tables):
+        if not args:
+                return b""
+
+        # split away delay argument from remaining string
+        delay, chars = args.split(" ", 1)
+
+        # build delaystr
+        delay = int(delay.strip(_WHITESPACE))
+        delaystr = DuckEncoder.delay2USBBytes(delay)
+
+        result = bytearray()
+        ascii_table = tables.ascii_table
+        # for every char
+        for c in chars.strip(_WHITESPACE):
+                val = ord(c)
+                keydata = ascii_table[val] if val < 256 else None
+                if keydata is None:
+                        keydata = DuckEncoder.tableChar2USBBytes(c, tables)
+                if len(keydata) > 0:
+                        result.extend(keydata)
+                        result.extend(delaystr)
+        return bytes(result)
+
+
+def _handle_simple_mod(key_name, mod_name, key_mod_name, args, tables):
+        # CTRL, ALT, SHIFT, GUI and COMMAND, bound to their names by _SIMPLE_MODS
+        result = bytearray()
+        # check if second argument after modifier command
+        if args:
+                # given key with modifier
+                result.extend(DuckEncoder.keyInstr2USBBytes(args, tables))
+                result.append(tables.modifier_table[mod_name])
+        else:
+                # modifier key on its own, only GUI adds its modifier
+                result.append(tables.keyname_table[key_name])
+                result.append(tables.modifier_table[key_mod_name] if key_mod_name else 0)
+        return bytes(result)
+
+
+def _handle_mod_combo(field, args, tables):
+        # CTRL-ALT, CTRL-SHIFT and COMMAND-OPTION, bound to the EncoderTables field of their
+        # or'ed modifiers by _MOD_COMBOS
+        # check if second argument after the modifier combination
+        if not args:
+                return b""
+        # key
+        result = bytearray(DuckEncoder.keyInstr2USBBytes(args, tables))
+        # modifiers or'ed together
+        result.append(getattr(tables, field))
+        return bytes(result)
+
+
+def _handle_alt_shift(args, tables):
+        result = bytearray()
+        # check if second argument after ALT+ SHIFT
+        if args:
+                # key
+                result.extend(DuckEncoder.keyInstr2USBBytes(args, tables))
+        else:
+                # left ALT as key
+                result.append(tables.keyname_table["KEY_LEFT_ALT"])
+        # modifier for ALT and SHIFT or'ed  together
+        result.append(tables.mod_alt_shift)
+        return bytes(result)
+
+
+def _handle_alt_tab(args, tables):
+        # no second argument allowed after ALT-TAB
+        if args:
+                return b""
+        # TAB key with ALT modifier
+        return bytes((tables.keyname_table["KEY_TAB"], tables.modifier_table["MODIFIERKEY_LEFT_ALT"]))
+
+
+# command: (key without argument, modifier with argument, modifier without argument)
+_SIMPLE_MODS = {"CONTROL": ("KEY_LEFT_CTRL", "MODIFIERKEY_CTRL", None),
+                "CTRL": ("KEY_LEFT_CTRL", "MODIFIERKEY_CTRL", None),
+                "ALT": ("KEY_LEFT_ALT", "MODIFIERKEY_ALT", None),
+                "SHIFT": ("KEY_LEFT_SHIFT", "MODIFIERKEY_SHIFT", None),
+                "GUI": ("KEY_LEFT_GUI", "MODIFIERKEY_LEFT_GUI", "MODIFIERKEY_LEFT_GUI"),
+                "WINDOWS": ("KEY_LEFT_GUI", "MODIFIERKEY_LEFT_GUI", "MODIFIERKEY_LEFT_GUI"),
+                "COMMAND": ("KEY_COMMAND", "MODIFIERKEY_LEFT_GUI", None)}
+
+# command: EncoderTables field holding the or'ed modifiers
+_MOD_COMBOS = {"CTRL-ALT": "mod_ctrl_alt",
+               "CTRL-SHIFT": "mod_ctrl_shift",
+               "COMMAND-OPTION": "mod_gui_alt"}
+
+_CMD_DISPATCH = {"DELAY": _handle_delay,
+                 "STRING": DuckEncoder.tableString2USBBytes,
+                 "STRING_DELAY": _handle_string_delay,
+                 "ALT-SHIFT": _handle_alt_shift,
+                 "ALT-TAB": _handle_alt_tab}
+_CMD_DISPATCH.update((cmd, functools.partial(_handle_simple_mod, *names)) for cmd, names in _SIMPLE_MODS.items())
+_CMD_DISPATCH.update((cmd, functools.partial(_handle_mod_combo, field)) for cmd, field in _MOD_COMBOS.items())
+
+
 def usage():
         """
         defines and prints a usage message for a Python script that encodes
@@ -790,8 +928,6 @@ def main(argv):
         '''
         Parses command line
         '''
-        script_dir = os.path.dirname(__file__) or "."
-
         ifile = ""
         source = None
         ofile = "inject.bin"
@@ -811,10 +947,8 @@ def main(argv):
                         if not os.path.isfile(ifile) or not os.access(ifile, os.R_OK):
                                 print("Input file " + ifile + " doesn't exist or isn't readable")
                                 sys.exit(2)
-                        with open(ifile, "rb") as f:
-                                source = f.read()
                 elif opt in ("-l", "--language"):
-                        lfile = script_dir + "/resources/" + arg + ".properties"
+                        lfile = os.path.join(_RES_DIR, "{0}.properties".format(arg))
 
                         if not os.path.isfile(lfile) or not os.access(lfile, os.R_OK):
                                 print("Language file " + lfile + " doesn't exist or isn't readable")
@@ -825,40 +959,39 @@ def main(argv):
                 elif opt in ("-p", "--passsthru"):
                         # read input from stdin, no outfile
                         ofile = None
-                        source = ""
-                        for line in sys.stdin:
-                                source += line
+                        # raw bytes, decoded as ISO 8859-1 by parseScript like -i input files
+                        source = sys.stdin.buffer.read()
                         # print "Source: " + source
                 elif opt in ("-r", "--rawpasssthru"):
                         # read input from stdin, no outfile
                         rawpassthru = True
                         ofile = None
-                        source = ""
-                        for line in sys.stdin:
-                                source += line
+                        # raw bytes, every byte is typed as the ISO 8859-1 char with the same code
+                        source = sys.stdin.buffer.read().decode("latin-1")
 
-        if source is None:
+        if source is None and not ifile:
                 print("You have to provide a source file (-i option)")
                 sys.exit(2)
 
         if rawpassthru:
                 # parse raw ascii data
-                result = ""
-                keyboard = DuckEncoder.readResource(script_dir + "/resources/keyboard.properties")
-                language = DuckEncoder.readResource(script_dir + "/resources/" + lang + ".properties")
-                for line in source:
-                        for c in line:
-                                keydata = DuckEncoder.ASCIIChar2USBBytes(c, keyboard, language)
-                                if len(keydata) > 0:
-                                        result += keydata
+                tables = DuckEncoder.langTables(lang)
+                result = DuckEncoder.tableString2USBBytes(source, tables)
+        elif source is None:
+                # parse input file as DuckyScript, lines are read one by one instead of reading
+                # the whole file first (ISO 8859-1, like bytes sources of parseScript)
+                with open(ifile, "r", encoding="latin-1", newline=None) as f:
+                        result = DuckEncoder.generatePayload(f, lang)
         else:
                 # parse source as DuckyScript
                 result = DuckEncoder.generatePayload(source, lang)
 
         if ofile is None:
-                # print to stdout
+                # print binary result to stdout (after any pending text output)
                 # print(result)
-                sys.stdout.write(result)
+                sys.stdout.flush()
+                sys.stdout.buffer.write(result)
+                sys.stdout.buffer.flush()
         else:
                 # write to ofile
                 with open(ofile, "wb") as f: